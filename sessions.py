@@ -0,0 +1,180 @@
+# sessions.py
+#
+# Session middlewares for the dashboard (both pure ASGI, both expose
+# request.session like Starlette's SessionMiddleware).
+#
+#   MiniSessionMiddleware   signed cookie (default). Cookie format matches
+#                           Starlette's, so existing logins survive. Verified
+#                           cookies are memoised, and Set-Cookie is only sent
+#                           when the serialised session actually changed.
+#   RedisSessionMiddleware  server-side store. The cookie only carries a
+#                           random id; the session dict lives in Redis as
+#                           orjson. Used when REDIS_URL is set.
+#
+# Env:
+#   REDIS_URL   e.g. redis://localhost:6379/0
+#
+import secrets
+import time
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import itsdangerous
+import orjson
+from itsdangerous.exc import BadSignature
+from starlette.datastructures import MutableHeaders
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def _cookie_from_scope(scope: Scope, name: str) -> Optional[str]:
+    """Pull one cookie straight out of the raw headers (no Request object)."""
+    for key, value in scope["headers"]:
+        if key == b"cookie":
+            raw = value.decode("latin-1")
+            if name + "=" not in raw:
+                continue
+            # Starlette's lenient parser: a malformed cookie from another app
+            # on the host must not hide ours (SimpleCookie drops the lot).
+            found = cookie_parser(raw).get(name)
+            if found is not None:
+                return found
+    return None
+
+
+class MiniSessionMiddleware:
+    """Signed-cookie sessions; drop-in for SessionMiddleware."""
+
+    _VERIFIED_MAX = 256
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret_key: str,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, same as SessionMiddleware
+        https_only: bool = False,
+    ) -> None:
+        self.app = app
+        self.signer = itsdangerous.TimestampSigner(secret_key)
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.cookie_flags = "path=/; httponly; samesite=lax" + ("; secure" if https_only else "")
+        # cookie value -> (signed-at, decoded payload). The dashboard polls
+        # several endpoints with the same cookie, so most requests skip the HMAC.
+        self._verified: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def _load(self, cookie: str) -> Optional[bytes]:
+        hit = self._verified.get(cookie)
+        if hit is not None:
+            signed_at, payload = hit
+            if time.time() - signed_at <= self.max_age:
+                self._verified.move_to_end(cookie)
+                return payload
+            del self._verified[cookie]
+            return None
+        try:
+            data, signed_at = self.signer.unsign(cookie.encode("utf-8"), max_age=self.max_age, return_timestamp=True)
+        except BadSignature:
+            return None
+        payload = b64decode(data)
+        self._verified[cookie] = (signed_at.timestamp(), payload)
+        if len(self._verified) > self._VERIFIED_MAX:
+            self._verified.popitem(last=False)
+        return payload
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        cookie = _cookie_from_scope(scope, self.session_cookie)
+        payload = self._load(cookie) if cookie else None
+        scope["session"] = orjson.loads(payload) if payload else {}
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                # Re-sign only when the serialised session differs from what the
+                # cookie carried, whichever dict method (or nested edit) changed it.
+                session: Dict[str, Any] = scope["session"]
+                headers = MutableHeaders(scope=message)
+                if session:
+                    encoded = orjson.dumps(session)
+                    if encoded != payload:
+                        data = self.signer.sign(b64encode(encoded)).decode("utf-8")
+                        headers.append(
+                            "Set-Cookie",
+                            f"{self.session_cookie}={data}; Max-Age={self.max_age}; {self.cookie_flags}",
+                        )
+                elif payload is not None:
+                    # session.clear() (logout): expire the cookie
+                    headers.append(
+                        "Set-Cookie",
+                        f"{self.session_cookie}=null; expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.cookie_flags}",
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class RedisSessionMiddleware:
+    """Drop-in for SessionMiddleware: exposes request.session, stores it in Redis."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        url: str,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, same as SessionMiddleware
+        key_prefix: str = "betfair-bot:session:",
+        https_only: bool = False,
+    ) -> None:
+        import redis.asyncio as aioredis  # optional dependency, only needed with REDIS_URL
+
+        self.app = app
+        self.redis = aioredis.from_url(url)
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.key_prefix = key_prefix
+        self.cookie_flags = "path=/; httponly; samesite=lax" + ("; secure" if https_only else "")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        sid: Optional[str] = _cookie_from_scope(scope, self.session_cookie)
+        raw: Optional[bytes] = await self.redis.get(self.key_prefix + sid) if sid else None
+        if raw is None:
+            sid = None  # unknown / expired id: start fresh
+        session: Dict[str, Any] = orjson.loads(raw) if raw else {}
+        scope["session"] = session
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                await self._commit(scope["session"], sid, raw, message)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _commit(self, session: Dict[str, Any], sid: Optional[str], raw: Optional[bytes], message: Message) -> None:
+        headers = MutableHeaders(scope=message)
+        if session:
+            payload = orjson.dumps(session)
+            if sid is not None and payload == raw:
+                return  # unchanged: no write, no cookie
+            if sid is None:
+                sid = secrets.token_urlsafe(32)
+                headers.append(
+                    "Set-Cookie",
+                    f"{self.session_cookie}={sid}; Max-Age={self.max_age}; {self.cookie_flags}",
+                )
+            await self.redis.set(self.key_prefix + sid, payload, ex=self.max_age)
+        elif sid is not None:
+            # session.clear() (logout): drop the stored copy and expire the cookie
+            await self.redis.delete(self.key_prefix + sid)
+            headers.append(
+                "Set-Cookie",
+                f"{self.session_cookie}=null; expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.cookie_flags}",
+            )
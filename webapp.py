@@ -15,44 +15,88 @@
 #   - Recent P/L history panel
 #   - Debug route: /inspect_hurdles
 #   - Live odds auto-refresh via /api/selected_live_odds (AJAX)
+#   - Status/bank/history auto-refresh via /api/state, Betfair balance via /api/funds (AJAX)
 #   - Responsive mobile layout (no sideways scroll; tables scroll inside cards)
 #   - Countdown timers per race
 #   - UI Logs panel
 #
 import os
+import asyncio
+import hashlib
+import time
 import datetime as dt
 import logging
-from collections import deque
-from typing import Optional, Any, Dict, List
-
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from starlette.middleware.sessions import SessionMiddleware
-
-from betfair_client import BetfairClient
-from strategy import StrategyState, BotRunner
+import logging.handlers
+import queue
+import threading
+import atexit
+import hmac
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import TYPE_CHECKING, Optional, Any, Awaitable, Callable, Dict, List, FrozenSet, Tuple
+
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError
+from markupsafe import Markup, escape
+from pydantic import BaseModel, ValidationError, field_validator
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+
+from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.middleware.gzip import GZipMiddleware
+
+from sessions import MiniSessionMiddleware
+from strategy import StrategyState, BotRunner, preview_dutch
+
+if TYPE_CHECKING:
+    # Imported for real in get_client(): requests + the Betfair client are only
+    # paid for once a logged-in page needs them, not on a cold /login.
+    from betfair_client import BetfairClient
 
 app = FastAPI()
 
 SESSION_SECRET = os.getenv("SESSION_SECRET", "dev-secret-change-me")
-app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+if REDIS_URL:
+    from sessions import RedisSessionMiddleware
+
+    app.add_middleware(RedisSessionMiddleware, url=REDIS_URL)
+else:
+    app.add_middleware(MiniSessionMiddleware, secret_key=SESSION_SECRET)
+
+# Added last so it wraps everything: the dashboard HTML/CSS compress ~5x.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "change-me")
 
+# Only the argon2 hash is ever compared against; the username compare runs
+# on bytes prepared once here.
+# One admin, one hash: OWASP's minimum argon2id profile (19 MiB, t=2, p=1)
+# rather than the library default of 64 MiB x 4 lanes per verify.
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19 * 1024, parallelism=1)
+# /login is unauthenticated; cap how many verifies (and their memory) run at once.
+_LOGIN_VERIFY_SLOTS = asyncio.Semaphore(2)
+_ADMIN_HASH = _password_hasher.hash(ADMIN_PASSWORD)
+_ADMIN_USER_B = ADMIN_USERNAME.encode("utf-8")
+
 BOT_MODE = os.getenv("BOT_MODE", "dummy").strip().lower()
 if BOT_MODE not in ("dummy", "simulation", "live"):
     BOT_MODE = "dummy"
 
 state = StrategyState()
 
-_client: Optional[BetfairClient] = None
+_client: Optional["BetfairClient"] = None
 runner: Optional[BotRunner] = None
 
 # -------------------------
 # In-app log buffer (UI logs)
 # -------------------------
 LOG_BUFFER = deque(maxlen=1000)
+LOG_TS_FORMAT = "%Y-%m-%d %H:%M:%S"  # UTC
 
 
 class UILogHandler(logging.Handler):
@@ -61,7 +105,7 @@ class UILogHandler(logging.Handler):
             msg = self.format(record)
         except Exception:
             msg = record.getMessage()
-        ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        ts = time.strftime(LOG_TS_FORMAT, time.gmtime(record.created))
         LOG_BUFFER.append(f"{ts} | {record.levelname:<7} | {msg}")
 
 
@@ -78,6 +122,29 @@ def setup_ui_logging() -> None:
 
 setup_ui_logging()
 
+# App logger: the request path only enqueues records; a listener thread does
+# the formatting and the stderr / UI-buffer writes.
+def setup_app_logging() -> logging.Logger:
+    logger = logging.getLogger("webapp")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False  # the listener already feeds the UI buffer
+    for h in logger.handlers:
+        if isinstance(h, logging.handlers.QueueHandler):
+            return logger
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[WEBAPP] %(levelname)s %(message)s"))
+    ui_handler = UILogHandler()
+    ui_handler.setFormatter(logging.Formatter("[WEBAPP] %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, ui_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+
+log = setup_app_logging()
+
 # Capture print() too
 import builtins  # noqa
 
@@ -88,7 +155,7 @@ if not getattr(builtins, "_ui_print_wrapped", False):
         _original_print(*args, **kwargs)
         try:
             msg = " ".join(str(a) for a in args)
-            ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            ts = time.strftime(LOG_TS_FORMAT, time.gmtime())
             LOG_BUFFER.append(f"{ts} | PRINT   | {msg}")
         except Exception:
             pass
@@ -97,94 +164,160 @@ if not getattr(builtins, "_ui_print_wrapped", False):
     builtins._ui_print_wrapped = True
 
 
-def get_client() -> BetfairClient:
+# Building the client logs in to Betfair outside dummy mode; the lock makes
+# sure concurrent first callers end up sharing one client.
+_client_lock = threading.Lock()
+
+
+def get_client() -> "BetfairClient":
     global _client, runner
-    if _client is None:
-        _client = BetfairClient(mode=BOT_MODE)
-    if runner is None:
-        runner = BotRunner(client=_client, state=state)
+    with _client_lock:
+        if _client is None:
+            from betfair_client import BetfairClient
+
+            _client = BetfairClient(mode=BOT_MODE)
+        if runner is None:
+            runner = BotRunner(client=_client, state=state)
     return _client
 
 
+async def aget_client() -> "BetfairClient":
+    """get_client() for request handlers: the first build runs off the event loop."""
+    if _client is not None and runner is not None:
+        return _client
+    return await asyncio.to_thread(get_client)
+
+
 def is_logged_in(request: Request) -> bool:
     return request.session.get("user") == "admin"
 
 
-def require_login(request: Request) -> Optional[RedirectResponse]:
+class LoginRequired(Exception):
+    """Raised by require_auth; turned into a redirect to /login."""
+
+
+async def require_auth(request: Request) -> None:
+    """Dependency for HTML routes: bounce anonymous users to the login page."""
+    if not is_logged_in(request):
+        raise LoginRequired()
+
+
+async def require_api_auth(request: Request) -> None:
+    """Dependency for JSON routes: anonymous users get a 401."""
     if not is_logged_in(request):
-        return RedirectResponse("/login", status_code=303)
-    return None
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.exception_handler(LoginRequired)
+async def login_required_handler(request: Request, exc: LoginRequired):
+    return RedirectResponse("/login", status_code=303)
+
+
+# -------------------------
+# Templates
+# -------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# Bump when anything under static/ changes; the assets are served immutable.
+STATIC_VERSION = "1"
+
+# Templates ship with the code, so there is no need to stat them on every
+# render; compiled bytecode is cached on disk across restarts.
+templates = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    bytecode_cache=FileSystemBytecodeCache(),
+    auto_reload=False,
+    autoescape=select_autoescape(["html"]),
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+templates.globals["static_version"] = STATIC_VERSION
+_LOGIN_TPL = templates.get_template("login.html")
+_DASHBOARD_TPL = templates.get_template("dashboard.html")
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with far-future caching; URLs carry ?v=STATIC_VERSION."""
+
+    def file_response(self, *args: Any, **kwargs: Any) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+
+
+# The login page only has one dynamic slot, so both variants are rendered once
+# at import: the plain page, and the error page split around the message.
+_LOGIN_PAGE_NOERROR = _LOGIN_TPL.render(error="").encode("utf-8")
+_LOGIN_ERR_PREFIX, _LOGIN_ERR_SUFFIX = _LOGIN_TPL.render(error="\x00").encode("utf-8").split(b"\x00")
+_LOGIN_HEADERS = {"Cache-Control": "no-store"}
 
 
 def render_login_page(error: str = "") -> HTMLResponse:
-    html = f"""
-    <html>
-    <head>
-      <title>Betfair Bot Login</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1" />
-      <style>
-        html, body {{ width: 100%; max-width: 100%; overflow-x: hidden; }}
-        body {{
-          font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-          background: #020617;
-          color: #e5e7eb;
-          margin: 0;
-          padding: 0;
-        }}
-        .container {{
-          max-width: 380px;
-          margin: 70px auto;
-          padding: 24px;
-          background: #020617;
-          border-radius: 16px;
-          border: 1px solid #1f2937;
-          box-shadow: 0 20px 25px -5px rgba(0,0,0,0.5);
-        }}
-        h1 {{ margin-top: 0; text-align: center; font-size: 1.5rem; }}
-        label {{ display: block; font-size: 0.85rem; margin-bottom: 4px; color: #9ca3af; }}
-        input[type="text"], input[type="password"] {{
-          width: 100%;
-          max-width: 100%;
-          padding: 10px 12px;
-          margin-bottom: 12px;
-          border-radius: 10px;
-          border: 1px solid #374151;
-          background: #020617;
-          color: #e5e7eb;
-          font-size: 0.95rem;
-          outline: none;
-        }}
-        button {{
-          width: 100%;
-          max-width: 100%;
-          padding: 10px;
-          border-radius: 999px;
-          border: none;
-          cursor: pointer;
-          background: linear-gradient(135deg, #22c55e, #16a34a);
-          color: white;
-          font-weight: 700;
-          font-size: 0.95rem;
-        }}
-        .error {{ color: #f97316; font-size: 0.9rem; margin-bottom: 10px; text-align: center; }}
-      </style>
-    </head>
-    <body>
-      <div class="container">
-        <h1>Betfair Bot Login</h1>
-        {("<div class='error'>" + error + "</div>") if error else ""}
-        <form method="POST" action="/login">
-          <label for="username">Username</label>
-          <input type="text" name="username" id="username" autocomplete="username" />
-          <label for="password">Password</label>
-          <input type="password" name="password" id="password" autocomplete="current-password" />
-          <button type="submit">Log In</button>
-        </form>
-      </div>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
+    if not error:
+        return HTMLResponse(_LOGIN_PAGE_NOERROR, headers=_LOGIN_HEADERS)
+    body = b"".join((_LOGIN_ERR_PREFIX, escape(error).encode("utf-8"), _LOGIN_ERR_SUFFIX))
+    return HTMLResponse(body, headers=_LOGIN_HEADERS)
+
+
+HTML_MEDIA_TYPE = "text/html; charset=utf-8"
+
+# Per-row markup for the dashboard's two loops. Filled with str.format_map and
+# joined once, then handed to the template as Markup; every value passed in
+# must already be HTML-escaped (see the *_row_vm helpers).
+MARKET_ROW_TMPL = """\
+            <label style="display:flex; gap:10px; align-items:flex-start; margin:8px 0;">
+              <input type="checkbox" name="selected_markets" value="{mid}" {checked} style="margin-top:3px;">
+              <span style="font-size:0.92rem; line-height:1.25;">
+                {name}
+                <div class="sub mono" style="margin-top:4px;">
+                  <span class="countdown" data-start="{start_raw}">—</span>
+                  <span class="muted"> | {mid}</span>
+                </div>
+              </span>
+            </label>
+"""
+
+HISTORY_ROW_TMPL = """\
+              <tr>
+                <td>{i}</td>
+                <td style="min-width:220px;">{race_name}</td>
+                <td>{favs}</td>
+                <td>£{total_stake:.2f}</td>
+                <td class="{pl_class}">£{pl:.2f}</td>
+                <td class="mono">{winner}</td>
+              </tr>
+"""
+
+
+def _market_row_vm(client: "BetfairClient", m: Dict[str, Any], selected: FrozenSet[str]) -> Dict[str, Any]:
+    """Values for MARKET_ROW_TMPL; text fields were escaped when the markets cache was filled."""
+    mid = m.get("market_id") or ""
+    return {
+        "mid": m["_mid_html"],
+        "name": m["_name_html"],
+        "checked": "checked" if mid in selected else "",
+        "start_raw": escape(_start_time_iso_z(client, mid) if mid else ""),
+    }
+
+
+def _history_row_vm(i: int, h: Dict[str, Any]) -> Dict[str, Any]:
+    """Values for HISTORY_ROW_TMPL; text fields are escaped once here."""
+    pl = float(h.get("pl", 0.0) or 0.0)
+    winner = h.get("winner_selection_id", None)
+    return {
+        "i": i,
+        "race_name": escape(h.get("race_name", "?")),
+        "favs": escape(h.get("favs", "")),
+        "total_stake": float(h.get("total_stake", 0.0) or 0.0),
+        "pl": pl,
+        "pl_class": "green-text" if pl >= 0 else "red-text",
+        "winner": escape(winner) if winner is not None else "—",
+    }
 
 
 def _safe_float(x: Any) -> Optional[float]:
@@ -194,7 +327,7 @@ def _safe_float(x: Any) -> Optional[float]:
         return None
 
 
-def _start_time_iso_z(client: BetfairClient, market_id: str) -> str:
+def _start_time_iso_z(client: "BetfairClient", market_id: str) -> str:
     try:
         st = client.get_market_start_time(market_id)
         if not st:
@@ -205,673 +338,272 @@ def _start_time_iso_z(client: BetfairClient, market_id: str) -> str:
             st = st.astimezone(dt.timezone.utc)
         return st.isoformat().replace("+00:00", "Z")
     except Exception as e:
-        print("[WEBAPP] start_time fetch error:", e)
+        log.warning("start_time fetch error for %s: %s", market_id, e)
         return ""
 
 
-def render_dashboard(message: str = "") -> HTMLResponse:
-    client = get_client()
+# Short-lived memo of the Betfair calls behind every dashboard render, so
+# repeated renders / form posts / polls don't each pay a blocking round-trip.
+# Process-wide is fine: there is one Betfair account and one admin.
+MARKETS_TTL = 10.0
+FUNDS_TTL = 5.0
+_cache: Dict[str, Tuple[float, Any]] = {}
+# Bumped only when a refill returns different data; the dashboard ETag uses
+# these instead of re-hashing the payloads on every request.
+_cache_versions: Dict[str, int] = {}
+# The counters restart at 1 on every boot, so ETags also carry a per-process
+# nonce: a browser revalidating after a restart must not get a stale 304.
+_ETAG_NONCE = os.urandom(8).hex()
+
+
+async def _cached(key: str, ttl: float, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """await fn() memoised under key for ttl seconds. Errors are not cached; the next call retries."""
+    now = time.monotonic()
+    hit = _cache.get(key)
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1]
+    value = await fn()
+    if hit is None or hit[1] != value:
+        _cache_versions[key] = _cache_versions.get(key, 0) + 1
+    _cache[key] = (now, value)
+    return value
+
+
+async def _fetch_markets(client: "BetfairClient") -> List[Dict[str, Any]]:
+    """Markets with their HTML-escaped id/name attached, so renders never re-escape them."""
+    markets = await client.aget_todays_novice_hurdle_markets()
+    out = []
+    for m in markets:
+        mid = m.get("market_id") or ""
+        out.append({**m, "_mid_html": escape(mid), "_name_html": escape(m.get("name", mid))})
+    return out
 
-    # Betfair balance (read-only)
-    bf_balance: Optional[float] = None
-    bf_err: Optional[str] = None
-    try:
-        funds = client.get_account_funds()
-        bf_balance = _safe_float(
-    funds.get("availableToBetBalance")
-    or funds.get("availableToBetBalanceUK")
-    or funds.get("availableToBetBalanceGBP")
-    or funds.get("available_to_bet")  # fallback for dummy/legacy
-)
 
-    except Exception as e:
-        bf_err = str(e)
-        print("[WEBAPP] Error fetching account funds:", e)
+async def cached_markets(client: "BetfairClient") -> List[Dict[str, Any]]:
+    return await _cached("markets", MARKETS_TTL, lambda: _fetch_markets(client))
 
-    # markets
-    try:
-        markets = client.get_todays_novice_hurdle_markets()
-    except Exception as e:
-        print("[WEBAPP] Error fetching markets:", e)
-        markets = []
 
-    selected = set(getattr(state, "selected_markets", []) or [])
+async def cached_funds(client: "BetfairClient") -> Dict[str, Any]:
+    return await _cached("funds", FUNDS_TTL, client.aget_account_funds)
 
-    running = bool(getattr(state, "running", False))
-    bank = float(getattr(state, "bank", 100.0) or 100.0)
-    starting_bank = float(getattr(state, "starting_bank", bank) or bank)
-    day_pl = bank - starting_bank
 
-    history: List[Dict[str, Any]] = []
-    if state.history:
-        history = list(state.history)[-15:][::-1]
+def _funds_view(funds: Any) -> Tuple[Optional[float], Optional[str]]:
+    """(bf_balance, bf_err) from a cached_funds() result or the exception it raised."""
+    if isinstance(funds, Exception):
+        log.error("Error fetching account funds: %s", funds)
+        return None, str(funds)
+    return _safe_float(funds.get("available_to_bet")), None
 
-    # mode pill
-    mode_label = BOT_MODE.upper()
-    if BOT_MODE == "simulation":
-        mode_desc = "SIMULATION (paper bank, real odds/results, NO bets)"
-    elif BOT_MODE == "dummy":
-        mode_desc = "DUMMY (fake data)"
-    else:
-        mode_desc = "LIVE (bet placement still guarded by ALLOW_LIVE_BETS)"
 
-    html = f"""
-    <html>
-    <head>
-      <title>Betfair 2-Fav Dutching Bot</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1" />
-      <style>
-        * {{ box-sizing: border-box; }}
-        html, body {{ width: 100%; max-width: 100%; overflow-x: hidden; }}
-        body {{
-          margin: 0;
-          font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-          background: #020617;
-          color: #e5e7eb;
-        }}
-        a {{ color: #38bdf8; text-decoration: none; }}
-        a:hover {{ text-decoration: underline; }}
-
-        .page {{ width: 100%; max-width: 1200px; margin: 0 auto; padding: 14px; }}
-
-        .top {{
-          display: flex;
-          flex-wrap: wrap;
-          justify-content: space-between;
-          align-items: flex-start;
-          gap: 10px;
-          margin-bottom: 12px;
-        }}
-        h1 {{ margin: 0; font-size: 1.4rem; }}
-        .sub {{ font-size: 0.82rem; color: #9ca3af; }}
-
-        .pill {{
-          border-radius: 999px;
-          padding: 4px 10px;
-          font-size: 0.75rem;
-          display: inline-flex;
-          align-items: center;
-          gap: 6px;
-          white-space: nowrap;
-        }}
-        .pill.green {{
-          background: rgba(34,197,94,0.1);
-          border: 1px solid rgba(34,197,94,0.3);
-          color: #4ade80;
-        }}
-        .pill.red {{
-          background: rgba(248,113,113,0.1);
-          border: 1px solid rgba(248,113,113,0.3);
-          color: #fca5a5;
-        }}
-        .pill.blue {{
-          background: rgba(56,189,248,0.08);
-          border: 1px solid rgba(56,189,248,0.25);
-          color: #7dd3fc;
-        }}
-
-        .grid {{
-          display: grid;
-          grid-template-columns: 1.1fr 1fr;
-          gap: 14px;
-        }}
-        @media (max-width: 900px) {{
-          .grid {{ grid-template-columns: 1fr; }}
-        }}
-
-        .card {{
-          background: #020617;
-          border-radius: 16px;
-          border: 1px solid #1f2937;
-          padding: 12px 14px;
-          box-shadow: 0 20px 25px -5px rgba(0,0,0,0.4);
-          min-width: 0;
-        }}
-
-        label {{ display: block; font-size: 0.8rem; margin-bottom: 3px; color: #9ca3af; }}
-
-        input[type="number"], input[type="text"] {{
-          width: 100%;
-          max-width: 100%;
-          padding: 8px 10px;
-          border-radius: 10px;
-          border: 1px solid #374151;
-          background: #020617;
-          color: #e5e7eb;
-          font-size: 0.9rem;
-          outline: none;
-        }}
-
-        .row {{
-          display: flex;
-          flex-wrap: wrap;
-          gap: 10px;
-        }}
-        .row > div {{
-          flex: 1 1 160px;
-          min-width: 0;
-        }}
-
-        .btn {{
-          border-radius: 999px;
-          padding: 8px 14px;
-          border: none;
-          cursor: pointer;
-          font-size: 0.85rem;
-          font-weight: 700;
-          display: inline-flex;
-          align-items: center;
-          justify-content: center;
-          gap: 8px;
-          max-width: 100%;
-        }}
-        .btn.primary {{
-          background: linear-gradient(135deg, #22c55e, #16a34a);
-          color: white;
-        }}
-        .btn.secondary {{
-          background: #0f172a;
-          color: #e5e7eb;
-          border: 1px solid #374151;
-        }}
-        .btn.danger {{
-          background: #b91c1c;
-          color: white;
-        }}
-        .btn.small {{
-          padding: 6px 10px;
-          font-size: 0.78rem;
-        }}
-
-        .message {{ color: #f97316; font-size: 0.85rem; margin-bottom: 10px; }}
-        .green-text {{ color: #4ade80; }}
-        .red-text {{ color: #fca5a5; }}
-
-        .list {{
-          max-height: 320px;
-          overflow-y: auto;
-          border-radius: 10px;
-          border: 1px solid #1f2937;
-          padding: 8px;
-        }}
-        .list label span, .list span, .list div, .list {{
-          overflow-wrap: anywhere;
-          word-break: break-word;
-        }}
-
-        .table-wrap {{
-          width: 100%;
-          overflow-x: auto;
-          -webkit-overflow-scrolling: touch;
-          border-radius: 10px;
-          border: 1px solid #1f2937;
-        }}
-        table {{
-          width: 100%;
-          border-collapse: collapse;
-          min-width: 760px;
-          font-size: 0.85rem;
-        }}
-        th, td {{
-          padding: 8px 10px;
-          border-bottom: 1px solid #1f2937;
-          vertical-align: top;
-        }}
-        th {{
-          text-align: left;
-          color: #9ca3af;
-          font-weight: 700;
-        }}
-        tr:last-child td {{ border-bottom: none; }}
-
-        .muted {{ color: #9ca3af; }}
-        .mono {{ font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace; }}
-      </style>
-    </head>
-    <body>
-      <div class="page">
-
-        <div class="top">
-          <div>
-            <h1>Betfair 2-Fav Dutching Bot</h1>
-            <div class="sub">
-              Logged in as <strong>{ADMIN_USERNAME}</strong> |
-              <a href="/logout">Log out</a> |
-              <a href="/inspect_hurdles">Inspect Markets</a>
-            </div>
-          </div>
-
-          <div style="text-align:right;">
-            <div class="pill {"green" if running else "red"}">
-              <span style="font-size:0.7rem;">●</span>
-              {"Running" if running else "Stopped"}
-            </div>
-            <div style="margin-top:6px; display:flex; justify-content:flex-end; gap:8px; flex-wrap:wrap;">
-              <div class="pill blue">{mode_label}</div>
-            </div>
-            <div class="sub" style="margin-top:6px;">
-              {mode_desc}
-            </div>
-          </div>
-        </div>
-
-        {f"<div class='message'><b>{message}</b></div>" if message else ""}
-
-        <div class="grid">
-
-          <!-- LEFT -->
-          <div class="card">
-            <h3 style="margin:0 0 10px 0;">Bank & Settings</h3>
-
-            <form method="post" action="/update_settings">
-              <div class="row">
-                <div>
-                  <label>Starting bank (£)</label>
-                  <input name="starting_bank" value="{getattr(state,'starting_bank',100.0)}">
-                </div>
-                <div>
-                  <label>Current bank (£)</label>
-                  <input name="current_bank" value="{getattr(state,'bank',100.0)}">
-                </div>
-              </div>
+async def _load_dashboard_data(client: "BetfairClient") -> Dict[str, Any]:
+    # Betfair balance (read-only) and markets, fetched in parallel off the event loop
+    funds, markets = await asyncio.gather(cached_funds(client), cached_markets(client), return_exceptions=True)
 
-              <div class="row" style="margin-top:10px;">
-                <div>
-                  <label>Stake %</label>
-                  <input name="stake_percent" value="{getattr(state,'stake_percent',5.0)}">
-                </div>
-                <div>
-                  <label>Seconds before off</label>
-                  <input name="seconds_before_off" value="{getattr(state,'seconds_before_off',60)}">
-                </div>
-              </div>
+    bf_balance, bf_err = _funds_view(funds)
+    funds_version = _cache_versions.get("funds") if bf_err is None else None
 
-              <div class="row" style="margin-top:10px;">
-                <div>
-                  <label>Min odds</label>
-                  <input name="min_odds" value="{getattr(state,'min_odds',1.01)}">
-                </div>
-                <div>
-                  <label>Max odds</label>
-                  <input name="max_odds" value="{getattr(state,'max_odds',1000.0)}">
-                </div>
-              </div>
+    markets_version = _cache_versions.get("markets")
+    if isinstance(markets, Exception):
+        log.error("Error fetching markets: %s", markets)
+        markets = []
+        markets_version = None
 
-              <div class="row" style="margin-top:10px;">
-                <div>
-                  <label>Scheduler tick (seconds)</label>
-                  <input name="tick_seconds" value="{getattr(state,'tick_seconds',30)}">
-                </div>
-                <div>
-                  <label>Loss carry (auto)</label>
-                  <input value="{getattr(state,'loss_carry',0.0):.2f}" disabled>
-                </div>
-              </div>
-
-              <div style="margin-top:10px;">
-                <div class="sub" style="margin-bottom:6px;">Quick stake profiles (% of bank)</div>
-                <div style="display:flex; flex-wrap:wrap; gap:8px;">
-                  <button class="btn secondary small" name="profile" value="2" type="submit">2%</button>
-                  <button class="btn secondary small" name="profile" value="5" type="submit">5%</button>
-                  <button class="btn secondary small" name="profile" value="10" type="submit">10%</button>
-                  <button class="btn secondary small" name="profile" value="15" type="submit">15%</button>
-                  <button class="btn secondary small" name="profile" value="20" type="submit">20%</button>
-                </div>
-              </div>
+    return {
+        "bf_balance": bf_balance,
+        "bf_err": bf_err,
+        "markets": markets,
+        "versions": (funds_version, markets_version),
+    }
 
-              <div style="margin-top:10px; display:flex; flex-wrap:wrap; gap:10px;">
-                <button class="btn primary" type="submit">Save</button>
-                <button class="btn secondary" name="reset_bank" value="1" type="submit">Reset</button>
-              </div>
-            </form>
 
-            <hr style="border-color:#1f2937; margin:14px 0;">
+def _dashboard_etag(data: Dict[str, Any], message: str = "") -> str:
+    """
+    Cheap fingerprint of everything the dashboard HTML depends on (incl. the flash message).
+    Countdowns / live odds / logs are filled in client-side, so they don't count.
+    """
+    fingerprint = (
+        _ETAG_NONCE,
+        state.running,
+        state.bank,
+        state.starting_bank,
+        state.stake_percent,
+        state.seconds_before_off,
+        state.min_odds,
+        state.max_odds,
+        state.tick_seconds,
+        state.loss_carry,
+        state.current_market_id,
+        state.current_index,
+        len(state.acted_market_ids),
+        len(state.history),
+        state.history[-1].get("ts") if state.history else None,  # len() stops moving once full
+        state.selected_set,  # only membership shows on the page; no per-request tuple copy
+        data["versions"],  # (funds, markets) cache versions; None when that fetch failed
+        data.get("bf_err"),
+        message,
+    )
+    return '"' + hashlib.blake2b(repr(fingerprint).encode(), digest_size=8).hexdigest() + '"'
+
+
+def _recent_history() -> List[Dict[str, Any]]:
+    """Last 15 history entries, newest first."""
+    return list(islice(reversed(state.history), 15))
+
+
+def _state_payload() -> Dict[str, Any]:
+    """Everything the dashboard's status panel + history table show (/api/state)."""
+    bank = float(state.bank or 0.0)
+    starting_bank = float(state.starting_bank or bank)
+    return {
+        "running": bool(state.running),
+        "mode": BOT_MODE,
+        "bank": bank,
+        "starting_bank": starting_bank,
+        "day_pl": bank - starting_bank,
+        "loss_carry": float(state.loss_carry or 0.0),
+        "current_market_id": state.current_market_id,
+        "acted": len(state.acted_market_ids),
+        "selected_markets": list(state.selected_markets),
+        "history": [
+            {
+                "race_name": h.get("race_name", "?"),
+                "favs": h.get("favs", ""),
+                "total_stake": float(h.get("total_stake", 0.0) or 0.0),
+                "pl": float(h.get("pl", 0.0) or 0.0),
+                "winner_selection_id": h.get("winner_selection_id"),
+            }
+            for h in _recent_history()
+        ],
+    }
 
-            <h3 style="margin:0 0 8px 0;">Races</h3>
-            <div class="sub" style="margin-bottom:8px;">
-              Tick races and save selection. Countdown uses Betfair market start time.
-            </div>
 
-            <form method="post" action="/update_race_selection">
-              <div class="list">
-    """
+def _json_response(payload: Any, status_code: int = 200) -> Response:
+    return Response(orjson.dumps(payload), status_code=status_code, media_type="application/json")
 
-    if not markets:
-        html += """
-                <div class="sub" style="color:#f97316;">No markets returned.</div>
-        """
-    else:
-        for m in markets:
-            mid = m.get("market_id") or ""
-            name = m.get("name", mid)
-            checked = "checked" if mid in selected else ""
-            start_raw = _start_time_iso_z(client, mid) if mid else ""
-            html += f"""
-                <label style="display:flex; gap:10px; align-items:flex-start; margin:8px 0;">
-                  <input type="checkbox" name="selected_markets" value="{mid}" {checked} style="margin-top:3px;">
-                  <span style="font-size:0.92rem; line-height:1.25;">
-                    {name}
-                    <div class="sub mono" style="margin-top:4px;">
-                      <span class="countdown" data-start="{start_raw}">—</span>
-                      <span class="muted"> | {mid}</span>
-                    </div>
-                  </span>
-                </label>
-            """
-
-    html += f"""
-              </div>
-
-              <div style="margin-top:10px;">
-                <button class="btn secondary" type="submit">Save races</button>
-              </div>
-            </form>
-          </div>
-
-          <!-- RIGHT -->
-          <div class="card">
-            <h3 style="margin:0 0 10px 0;">Status & Controls</h3>
-
-            <div class="row" style="margin-bottom:10px;">
-              <div>
-                <div class="sub">Current bank</div>
-                <div style="font-size:1.2rem;">£{bank:.2f}</div>
-              </div>
-              <div>
-                <div class="sub">Day P/L</div>
-                <div class="{"green-text" if day_pl >= 0 else "red-text"}" style="font-size:1.1rem;">
-                  £{day_pl:.2f}
-                </div>
-              </div>
-              <div>
-                <div class="sub">Betfair balance</div>
-                <div style="font-size:1.05rem;">
-                  {("£" + f"{bf_balance:.2f}") if bf_balance is not None else "—"}
-                </div>
-                {f"<div class='sub' style='color:#f97316;'>({bf_err})</div>" if bf_err else ""}
-              </div>
-            </div>
-
-            <div class="row" style="margin-bottom:10px;">
-              <div>
-                <div class="sub">Current market</div>
-                <div class="mono" style="font-size:0.9rem;">{getattr(state,'current_market_id',None) or "—"}</div>
-              </div>
-              <div>
-                <div class="sub">Acted (de-dup)</div>
-                <div style="font-size:0.95rem;">{len(getattr(state,'acted_market_ids',set()) or set())}</div>
-              </div>
-              <div>
-                <div class="sub">Loss carry</div>
-                <div style="font-size:0.95rem;">£{getattr(state,'loss_carry',0.0):.2f}</div>
-              </div>
-            </div>
-
-            <div style="display:flex; flex-wrap:wrap; gap:10px;">
-              <form method="post" action="/start">
-                <button class="btn primary" type="submit">▶ Start</button>
-              </form>
-              <form method="post" action="/stop">
-                <button class="btn danger" type="submit">■ Stop</button>
-              </form>
-            </div>
-
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">Live odds + projected winnings</h3>
-            <div class="sub" style="margin-bottom:8px;">
-              Auto-refresh every ~10s for selected races (top 2 favourites).
-            </div>
-
-            <div class="table-wrap">
-              <table>
-                <thead>
-                  <tr>
-                    <th>Race</th>
-                    <th>Countdown</th>
-                    <th>Fav 1</th>
-                    <th>Odds</th>
-                    <th>Stake</th>
-                    <th>Fav 2</th>
-                    <th>Odds</th>
-                    <th>Stake</th>
-                    <th>Profit if wins</th>
-                    <th>Status</th>
-                  </tr>
-                </thead>
-                <tbody id="oddsBody">
-                  <tr><td colspan="10" class="muted">Select races to populate this table.</td></tr>
-                </tbody>
-              </table>
-            </div>
-
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">History</h3>
-    """
 
-    if history:
-        html += """
-            <div class="table-wrap">
-              <table>
-                <thead>
-                  <tr>
-                    <th>#</th>
-                    <th>Race</th>
-                    <th>Favourites</th>
-                    <th>Total stake</th>
-                    <th>P/L</th>
-                    <th>Winner</th>
-                  </tr>
-                </thead>
-                <tbody>
-        """
-        for i, h in enumerate(history, 1):
-            race_name = h.get("race_name", "?")
-            favs = h.get("favs", "")
-            total_stake_h = float(h.get("total_stake", 0.0) or 0.0)
-            pl = float(h.get("pl", 0.0) or 0.0)
-            cls = "green-text" if pl >= 0 else "red-text"
-            winner = h.get("winner_selection_id", None)
-            html += f"""
-                  <tr>
-                    <td>{i}</td>
-                    <td style="min-width:220px;">{race_name}</td>
-                    <td>{favs}</td>
-                    <td>£{total_stake_h:.2f}</td>
-                    <td class="{cls}">£{pl:.2f}</td>
-                    <td class="mono">{winner if winner is not None else "—"}</td>
-                  </tr>
-            """
-        html += """
-                </tbody>
-              </table>
-            </div>
-        """
-    else:
-        html += """<div class="sub muted">No races yet.</div>"""
-
-    # Logs panel
-    html += """
-            <hr style="border-color:#1f2937; margin:14px 0;">
-            <h3 style="margin:0 0 8px 0;">Logs</h3>
-            <div class="sub" style="margin-bottom:8px;">Live app logs (auto-refresh)</div>
-
-            <div style="border:1px solid #1f2937;border-radius:10px; padding:10px; max-height:260px; overflow:auto;">
-              <pre id="logBox" style="margin:0; white-space:pre-wrap; overflow-wrap:anywhere; font-size:0.78rem; line-height:1.2;"></pre>
-            </div>
-
-            <div style="display:flex;gap:10px;margin-top:10px;flex-wrap:wrap;">
-              <button class="btn secondary small" type="button" onclick="fetchLogs(true)">Refresh</button>
-              <button class="btn secondary small" type="button" onclick="clearLogBox()">Clear</button>
-            </div>
+def _wants_json(request: Request) -> bool:
+    return "application/json" in request.headers.get("accept", "")
+
+
+def _action_response(request: Request, message: str, **extra: Any) -> Response:
+    """
+    fetch() callers get {"ok", "message", **extra} JSON; plain form posts are
+    redirected back to the dashboard (Post/Redirect/Get) with the message
+    stashed in the session as a one-shot flash.
     """
+    if _wants_json(request):
+        return _json_response({"ok": True, "message": message, **extra})
+    request.session["flash"] = message
+    return RedirectResponse("/", status_code=303)
+
+
+# Rendered dashboard bytes keyed on (state fingerprint, message); a handful of
+# entries is plenty since only the latest state is ever requested. Any state
+# change moves the fingerprint, so entries never need clearing.
+_RENDER_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+_RENDER_CACHE_MAX = 4
+
+
+async def render_dashboard(message: str, data: Dict[str, Any], etag: str) -> Response:
+    client = await aget_client()
+    key = f"{etag}|{message}"
+    body = _RENDER_CACHE.get(key)
+    if body is None:
+        body = _render_dashboard_bytes(client, message, data)
+        _RENDER_CACHE[key] = body
+        if len(_RENDER_CACHE) > _RENDER_CACHE_MAX:
+            _RENDER_CACHE.popitem(last=False)
+    else:
+        _RENDER_CACHE.move_to_end(key)
 
-    html += """
-          </div>
-        </div>
-      </div>
-
-      <script>
-        function parseISO(s) {
-          if (!s) return null;
-          const d = new Date(s);
-          if (isNaN(d.getTime())) return null;
-          return d;
-        }
-
-        function fmt(sec) {
-          sec = Math.max(0, Math.floor(sec));
-          const h = Math.floor(sec / 3600);
-          const m = Math.floor((sec % 3600) / 60);
-          const s = sec % 60;
-          if (h > 0) return h + "h " + m + "m " + s + "s";
-          if (m > 0) return m + "m " + s + "s";
-          return s + "s";
-        }
-
-        function tickCountdowns() {
-          const els = document.querySelectorAll(".countdown");
-          const now = new Date();
-          els.forEach(el => {
-            const startRaw = el.getAttribute("data-start") || "";
-            const start = parseISO(startRaw);
-            if (!start) { el.textContent = "—"; return; }
-            const diffSec = (start.getTime() - now.getTime()) / 1000;
-            if (diffSec <= 0) { el.textContent = "OFF / started"; return; }
-            el.textContent = "Off in " + fmt(diffSec);
-          });
-        }
-
-        // ---- odds auto-refresh ----
-        function td(text, cls="") {
-          const el = document.createElement("td");
-          if (cls) el.className = cls;
-          el.textContent = text;
-          return el;
-        }
-
-        async function fetchOdds() {
-          try {
-            const r = await fetch("/api/selected_live_odds", { cache: "no-store" });
-            if (!r.ok) return;
-            const j = await r.json();
-            const rows = j.rows || [];
-            const body = document.getElementById("oddsBody");
-            if (!body) return;
-
-            body.innerHTML = "";
-
-            if (!rows.length) {
-              const tr = document.createElement("tr");
-              const cell = document.createElement("td");
-              cell.colSpan = 10;
-              cell.className = "muted";
-              cell.textContent = "Select races to populate this table.";
-              tr.appendChild(cell);
-              body.appendChild(tr);
-              return;
-            }
+    return Response(body, media_type=HTML_MEDIA_TYPE)
 
-            rows.forEach(row => {
-              const tr = document.createElement("tr");
-
-              if (row.error) {
-                tr.appendChild(td(row.race || row.market_id || "?", ""));
-                tr.appendChild(td("—", "mono"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—"));
-                tr.appendChild(td("—", "red-text"));
-                tr.appendChild(td("Error: " + row.error, "red-text"));
-                body.appendChild(tr);
-                return;
-              }
-
-              const cdSpan = document.createElement("span");
-              cdSpan.className = "countdown mono";
-              cdSpan.setAttribute("data-start", row.start_raw || "");
-              cdSpan.textContent = "—";
-
-              const cdTd = document.createElement("td");
-              cdTd.appendChild(cdSpan);
-
-              tr.appendChild(td(row.race || "?", ""));
-              tr.appendChild(cdTd);
-              tr.appendChild(td(row.fav1_name || "—"));
-              tr.appendChild(td((row.odds1 || 0).toFixed(2)));
-              tr.appendChild(td("£" + (row.stake1 || 0).toFixed(2)));
-              tr.appendChild(td(row.fav2_name || "—"));
-              tr.appendChild(td((row.odds2 || 0).toFixed(2)));
-              tr.appendChild(td("£" + (row.stake2 || 0).toFixed(2)));
-
-              const profit = row.profit_if_win || 0;
-              tr.appendChild(td("£" + profit.toFixed(2), profit >= 0 ? "green-text" : "red-text"));
-
-              tr.appendChild(td(row.note || "OK", row.note && row.note !== "OK" ? "muted" : ""));
-              body.appendChild(tr);
-            });
-
-            tickCountdowns();
-          } catch (e) {}
-        }
-
-        // ---- UI logs ----
-        async function fetchLogs(forceScroll=false) {
-          try {
-            const r = await fetch("/api/logs?n=300", { cache: "no-store" });
-            if (!r.ok) return;
-            const j = await r.json();
-            const el = document.getElementById("logBox");
-            if (!el) return;
-
-            const nearBottom = (el.scrollTop + el.clientHeight) >= (el.scrollHeight - 40);
-            el.textContent = (j.lines || []).join("\\n");
-
-            if (forceScroll || nearBottom) {
-              el.scrollTop = el.scrollHeight;
-            }
-          } catch (e) {}
-        }
 
-        function clearLogBox() {
-          const el = document.getElementById("logBox");
-          if (el) el.textContent = "";
-        }
+def _render_dashboard_bytes(client: "BetfairClient", message: str, data: Dict[str, Any]) -> bytes:
 
-        tickCountdowns();
-        setInterval(tickCountdowns, 1000);
+    bf_balance: Optional[float] = data["bf_balance"]
+    bf_err: Optional[str] = data["bf_err"]
+    markets: List[Dict[str, Any]] = data["markets"]
 
-        fetchOdds();
-        setInterval(fetchOdds, 10000);
+    # Snapshot state once; the template only sees plain locals.
+    selected = state.selected_set
+    running = bool(state.running)
+    bank = float(state.bank or 100.0)
+    starting_bank = float(state.starting_bank or bank)
+    day_pl = bank - starting_bank
 
-        fetchLogs(true);
-        setInterval(fetchLogs, 2000);
-      </script>
-    </body>
-    </html>
-    """
+    history = _recent_history()
+    bf_balance_text = f"£{bf_balance:.2f}" if bf_balance is not None else "—"
+    market_row = MARKET_ROW_TMPL.format_map
+    history_row = HISTORY_ROW_TMPL.format_map
+
+    # mode pill
+    mode_label = BOT_MODE.upper()
+    if BOT_MODE == "simulation":
+        mode_desc = "SIMULATION (paper bank, real odds/results, NO bets)"
+    elif BOT_MODE == "dummy":
+        mode_desc = "DUMMY (fake data)"
+    else:
+        mode_desc = "LIVE (bet placement still guarded by ALLOW_LIVE_BETS)"
 
-    return HTMLResponse(html)
+    return _DASHBOARD_TPL.render(
+        admin_username=ADMIN_USERNAME,
+        running=running,
+        mode_label=mode_label,
+        mode_desc=mode_desc,
+        message=message,
+        bank=bank,
+        starting_bank=starting_bank,
+        # The settings inputs echo the stored values: the display fallbacks
+        # above would be saved back on the next submit (e.g. a £0 bank -> 100).
+        bank_input=state.bank,
+        starting_bank_input=state.starting_bank,
+        day_pl=day_pl,
+        stake_percent=state.stake_percent,
+        seconds_before_off=state.seconds_before_off,
+        min_odds=state.min_odds,
+        max_odds=state.max_odds,
+        tick_seconds=state.tick_seconds,
+        loss_carry=float(state.loss_carry or 0.0),
+        current_market_id=state.current_market_id,
+        acted_count=len(state.acted_market_ids),
+        bf_balance_text=bf_balance_text,
+        bf_err=bf_err,
+        market_rows=Markup("".join([market_row(_market_row_vm(client, m, selected)) for m in markets])),
+        history_rows=Markup("".join([history_row(_history_row_vm(i, h)) for i, h in enumerate(history, start=1)])),
+    ).encode("utf-8")
 
 
 # -------------------------
 # Routes
 # -------------------------
 
-@app.get("/login")
+@app.get("/login", response_class=HTMLResponse)
 async def login_get(request: Request):
     if is_logged_in(request):
         return RedirectResponse("/", status_code=303)
     return render_login_page()
 
 
-@app.post("/login")
-async def login_post(request: Request, username: str = Form(...), password: str = Form(...)):
-    if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
+def _verify_admin_password(password: str) -> bool:
+    try:
+        return _password_hasher.verify(_ADMIN_HASH, password)
+    except VerifyMismatchError:
+        return False
+
+
+@app.post("/login", response_class=HTMLResponse)
+async def login_post(request: Request):
+    # Two plain strings: read the form directly rather than via Form() params.
+    form = await request.form()
+    username = str(form.get("username", ""))
+    password = str(form.get("password", ""))
+    # Always run both checks so a wrong username takes as long as a wrong password.
+    # argon2 is deliberately slow, so it runs off the event loop.
+    user_ok = hmac.compare_digest(username.encode("utf-8"), _ADMIN_USER_B)
+    async with _LOGIN_VERIFY_SLOTS:
+        password_ok = await asyncio.to_thread(_verify_admin_password, password)
+    if user_ok and password_ok:
         request.session["user"] = "admin"
         return RedirectResponse("/", status_code=303)
     return render_login_page("Invalid username or password.")
@@ -883,123 +615,142 @@ async def logout(request: Request):
     return RedirectResponse("/login", status_code=303)
 
 
-@app.get("/", response_class=HTMLResponse)
+@app.get("/", response_class=HTMLResponse, dependencies=[Depends(require_auth)])
 async def home(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-    return render_dashboard()
-
-
-@app.post("/update_settings")
-async def update_settings(
-    request: Request,
-    starting_bank: str = Form(...),
-    current_bank: str = Form(...),
-    stake_percent: str = Form(...),
-    seconds_before_off: str = Form("60"),
-    min_odds: str = Form("1.01"),
-    max_odds: str = Form("1000"),
-    tick_seconds: str = Form("30"),
-    profile: str = Form(None),
-    reset_bank: str = Form(None),
-):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
-    def f(v: str, default: float) -> float:
+    # Polling / refreshes with unchanged state get a 304 instead of a re-render
+    msg = request.session.pop("flash", "")
+    data = await _load_dashboard_data(await aget_client())
+    etag = _dashboard_etag(data, msg)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response = await render_dashboard(msg, data=data, etag=etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+class SettingsForm(BaseModel):
+    """
+    /update_settings body, parsed in one pass. Unparseable numbers come through
+    as None so the handler keeps the current value instead of rejecting the save.
+    """
+
+    starting_bank: Optional[float]
+    current_bank: Optional[float]
+    stake_percent: Optional[float]
+    seconds_before_off: Optional[int] = 60
+    min_odds: Optional[float] = 1.01
+    max_odds: Optional[float] = 1000.0
+    tick_seconds: Optional[int] = 30
+    profile: Optional[str] = None
+    reset_bank: Optional[str] = None
+
+    @field_validator("starting_bank", "current_bank", "stake_percent", "min_odds", "max_odds", mode="before")
+    @classmethod
+    def _float_or_none(cls, v: Any) -> Optional[float]:
         try:
             return float(v)
         except Exception:
-            return default
+            return None
 
-    def i(v: str, default: int) -> int:
+    @field_validator("seconds_before_off", "tick_seconds", mode="before")
+    @classmethod
+    def _int_or_none(cls, v: Any) -> Optional[int]:
         try:
             return int(float(v))
         except Exception:
-            return default
+            return None
+
+    @classmethod
+    async def as_form(cls, request: Request) -> "SettingsForm":
+        form = await request.form()
+        try:
+            return cls.model_validate(dict(form))
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+
+
+@app.post("/update_settings", dependencies=[Depends(require_auth)])
+async def update_settings(request: Request, form: SettingsForm = Depends(SettingsForm.as_form)):
+    def pick(v: Any, current: Any) -> Any:
+        return current if v is None else v
 
-    sb = f(starting_bank, float(getattr(state, "starting_bank", 100.0) or 100.0))
-    cb = f(current_bank, float(getattr(state, "bank", sb) or sb))
-    sp = f(stake_percent, float(getattr(state, "stake_percent", 5.0) or 5.0))
-    sbo = i(seconds_before_off, int(getattr(state, "seconds_before_off", 60) or 60))
-    mn = f(min_odds, float(getattr(state, "min_odds", 1.01) or 1.01))
-    mx = f(max_odds, float(getattr(state, "max_odds", 1000.0) or 1000.0))
-    tk = i(tick_seconds, int(getattr(state, "tick_seconds", 30) or 30))
+    sb = pick(form.starting_bank, float(state.starting_bank or 100.0))
+    cb = pick(form.current_bank, float(state.bank or sb))
+    sp = pick(form.stake_percent, float(state.stake_percent or 5.0))
+    sbo = pick(form.seconds_before_off, int(state.seconds_before_off or 60))
+    mn = pick(form.min_odds, float(state.min_odds or 1.01))
+    mx = pick(form.max_odds, float(state.max_odds or 1000.0))
+    tk = pick(form.tick_seconds, int(state.tick_seconds or 30))
 
-    if profile in ("2", "5", "10", "15", "20"):
-        sp = float(profile)
+    if form.profile in ("2", "5", "10", "15", "20"):
+        sp = float(form.profile)
 
     state.starting_bank = sb
-    state.bank = sb if reset_bank else cb
+    state.bank = sb if form.reset_bank else cb
     state.stake_percent = sp
     state.seconds_before_off = max(0, sbo)
     state.min_odds = max(1.01, mn)
     state.max_odds = max(state.min_odds, mx)
     state.tick_seconds = max(5, tk)
 
-    return render_dashboard("Settings saved.")
+    settings = {
+        "starting_bank": state.starting_bank,
+        "current_bank": state.bank,
+        "stake_percent": state.stake_percent,
+        "seconds_before_off": state.seconds_before_off,
+        "min_odds": state.min_odds,
+        "max_odds": state.max_odds,
+        "tick_seconds": state.tick_seconds,
+    }
+    return _action_response(request, "Settings saved.", settings=settings)
 
 
-@app.post("/update_race_selection")
+@app.post("/update_race_selection", dependencies=[Depends(require_auth)])
 async def update_race_selection(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
     form = await request.form()
-    state.selected_markets = form.getlist("selected_markets")
+    state.select_markets(form.getlist("selected_markets"))
     state.current_index = 0
-    return render_dashboard("Races updated.")
-
+    return _action_response(request, "Races updated.")
 
-@app.post("/start")
-async def start_bot(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
 
-    if not getattr(state, "selected_markets", []):
-        return render_dashboard("No races selected – tick at least one race and save.")
+# Serialises start/stop so a double-click can't interleave the two.
+_bot_lock = asyncio.Lock()
 
-    get_client()
-    global runner
-    if runner is None:
-        runner = BotRunner(client=_client, state=state)  # type: ignore
-    runner.start()
-    return render_dashboard("Bot started.")
 
+async def start_bot() -> str:
+    if not state.selected_set:
+        return "No races selected – tick at least one race and save."
 
-@app.post("/stop")
-async def stop_bot(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
+    async with _bot_lock:
+        await aget_client()  # also builds the runner
+        # start() only schedules the runner's loop as a task, so it stays on the event loop
+        runner.start()
+    _cache.pop("markets", None)  # refetch the card on the next render
+    return "Bot started."
 
-    get_client()
-    global runner
-    if runner is None:
-        return render_dashboard("Bot already stopped.")
-    runner.stop()
-    return render_dashboard("Bot stopped.")
 
+async def stop_bot() -> str:
+    async with _bot_lock:
+        # No runner means nothing was ever started; don't log in just to stop.
+        if runner is None:
+            return "Bot already stopped."
+        runner.stop()
+    return "Bot stopped."
 
-@app.get("/inspect_hurdles")
-async def inspect_hurdles(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
 
-    client = get_client()
-    markets = client.get_todays_novice_hurdle_markets()
+# Form-less POST actions: /<name> -> coroutine returning the message to show.
+# Actions with form fields (settings, race selection) keep their own routes.
+_ACTIONS = {
+    "start": start_bot,
+    "stop": stop_bot,
+}
 
-    items = "".join(
-        f"<li>{m.get('name','?')} <span style='color:#9ca3af;'>({m.get('market_id','?')})</span></li>"
-        for m in markets
-    )
 
-    html = f"""
+# Static shell of the inspect page; BOT_MODE is fixed at import, so only the
+# market list is built per request.
+_INSPECT_HEAD = f"""
     <html>
       <head>
         <meta name="viewport" content="width=device-width, initial-scale=1" />
@@ -1009,30 +760,47 @@ async def inspect_hurdles(request: Request):
         <h2>Inspect Markets</h2>
         <p><a href="/" style="color:#38bdf8;">Back</a></p>
         <p>Mode: <b>{BOT_MODE.upper()}</b></p>
-        <ul>{items}</ul>
+        <ul>"""
+_INSPECT_FOOT = """</ul>
       </body>
     </html>
     """
-    return HTMLResponse(html)
+INSPECT_ROW_TMPL = "<li>{name} <span style='color:#9ca3af;'>({mid})</span></li>"
+
+# Rendered page for the markets list it was built from; rebuilt only when the
+# TTL cache hands back a different list.
+_INSPECT_MEMO: Dict[str, Any] = {"markets": None, "body": b""}
+
+
+@app.get("/inspect_hurdles", dependencies=[Depends(require_auth)])
+async def inspect_hurdles():
+    markets = await cached_markets(await aget_client())
 
+    if _INSPECT_MEMO["markets"] is not markets:
+        items = "".join(
+            INSPECT_ROW_TMPL.format(name=m["_name_html"], mid=m["_mid_html"])
+            for m in markets
+        )
+        body = "".join((_INSPECT_HEAD, items, _INSPECT_FOOT)).encode("utf-8")
+        _INSPECT_MEMO.update(markets=markets, body=body)
+    return Response(_INSPECT_MEMO["body"], media_type=HTML_MEDIA_TYPE)
 
-@app.get("/api/selected_live_odds")
-async def api_selected_live_odds(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
 
-    client = get_client()
+@app.get("/api/selected_live_odds", dependencies=[Depends(require_api_auth)])
+async def api_selected_live_odds():
+    client = await aget_client()
 
-    bank = float(getattr(state, "bank", 100.0) or 100.0)
-    stake_percent = float(getattr(state, "stake_percent", 5.0) or 5.0)
+    # One snapshot of the settings for the whole table
+    bank = float(state.bank or 100.0)
+    stake_percent = float(state.stake_percent or 5.0)
     base_stake = max(0.0, bank * (stake_percent / 100.0))
 
-    min_odds = float(getattr(state, "min_odds", 1.01) or 1.01)
-    max_odds = float(getattr(state, "max_odds", 1000.0) or 1000.0)
+    min_odds = float(state.min_odds or 1.01)
+    max_odds = float(state.max_odds or 1000.0)
+    loss_carry = float(state.loss_carry or 0.0)
 
     out = []
-    for mid in getattr(state, "selected_markets", []) or []:
+    for mid in state.selected_markets:
         try:
             favs = client.get_top_two_favourites(mid)
             race = client.get_market_name(mid)
@@ -1056,20 +824,7 @@ async def api_selected_live_odds(request: Request):
                 continue
 
             # For preview: show what the bot would do NEXT given current loss_carry
-            loss_carry = float(getattr(state, "loss_carry", 0.0) or 0.0)
-
-            inv_sum = (1.0 / o1) + (1.0 / o2)
-            denom = (1.0 / inv_sum) - 1.0
-            total_stake = base_stake
-
-            if loss_carry > 0 and denom > 0:
-                req = loss_carry / denom
-                total_stake = max(base_stake, req)
-
-            # dutch
-            s1 = total_stake * (1.0 / o1) / inv_sum
-            s2 = total_stake - s1
-            profit_each = total_stake / inv_sum - total_stake
+            calc = preview_dutch(o1, o2, base_stake, loss_carry)
 
             out.append({
                 "market_id": mid,
@@ -1079,1000 +834,87 @@ async def api_selected_live_odds(request: Request):
                 "fav2_name": favs[1]["name"],
                 "odds1": o1,
                 "odds2": o2,
-                "stake1": s1,
-                "stake2": s2,
-                "profit_if_win": profit_each,
+                "stake1": calc["stake1"],
+                "stake2": calc["stake2"],
+                "profit_if_win": calc["profit_each"],
                 "note": "OK",
             })
 
         except Exception as e:
             out.append({"market_id": mid, "race": mid, "start_raw": "", "error": str(e)})
 
-    return JSONResponse({"rows": out})
+    return _json_response({"rows": out})
 
 
-@app.get("/api/logs")
-async def api_logs(request: Request, n: int = 300):
-    redirect = require_login(request)
-    if redirect:
-        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
-
+@app.get("/api/logs", dependencies=[Depends(require_api_auth)])
+async def api_logs(n: int = 300):
     try:
         n = int(n)
     except Exception:
         n = 300
     n = max(1, min(n, 1000))
     lines = list(LOG_BUFFER)[-n:]
-    return JSONResponse({"lines": lines})
-ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "adamhill")
-ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "Adamhillonline1!")
-
-USE_DUMMY = os.getenv("BETFAIR_DUMMY", "true").lower() == "true"
-
-state = StrategyState()
-
-_client: Optional[BetfairClient] = None
-runner: Optional[BotRunner] = None
-
-# -------------------------
-# In-app log buffer (UI logs)
-# -------------------------
-LOG_BUFFER = deque(maxlen=800)  # keep last 800 lines
-
-
-class UILogHandler(logging.Handler):
-    def emit(self, record: logging.LogRecord) -> None:
-        try:
-            msg = self.format(record)
-        except Exception:
-            msg = record.getMessage()
-        ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        LOG_BUFFER.append(f"{ts} | {record.levelname:<7} | {msg}")
-
-
-def setup_ui_logging() -> None:
-    root = logging.getLogger()
-    root.setLevel(logging.INFO)
-
-    for h in list(root.handlers):
-        if isinstance(h, UILogHandler):
-            return
-
-    h = UILogHandler()
-    h.setFormatter(logging.Formatter("%(message)s"))
-    root.addHandler(h)
-
-
-setup_ui_logging()
-
-# Capture print() too (your code uses print a lot)
-import builtins  # noqa: E402
-
-if not getattr(builtins, "_ui_print_wrapped", False):
-    _original_print = builtins.print
-
-    def ui_print(*args, **kwargs):
-        _original_print(*args, **kwargs)
-        try:
-            msg = " ".join(str(a) for a in args)
-            ts = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-            LOG_BUFFER.append(f"{ts} | PRINT   | {msg}")
-        except Exception:
-            pass
-
-    builtins.print = ui_print
-    builtins._ui_print_wrapped = True
-
-
-def get_client() -> BetfairClient:
-    global _client, runner
-    if _client is None:
-        _client = BetfairClient(use_dummy=USE_DUMMY)
-    if runner is None:
-        runner = BotRunner(client=_client, state=state)
-    return _client
-
-
-def is_logged_in(request: Request) -> bool:
-    return request.session.get("user") == "admin"
-
-
-def require_login(request: Request) -> Optional[RedirectResponse]:
-    if not is_logged_in(request):
-        return RedirectResponse("/login", status_code=303)
-    return None
-
-
-def render_login_page(error: str = "") -> HTMLResponse:
-    html = f"""
-    <html>
-    <head>
-      <title>Betfair Bot Login</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1" />
-      <style>
-        html, body {{ width: 100%; max-width: 100%; overflow-x: hidden; }}
-        body {{
-          font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-          background: #020617;
-          color: #e5e7eb;
-          margin: 0;
-          padding: 0;
-        }}
-        .container {{
-          max-width: 380px;
-          margin: 70px auto;
-          padding: 24px;
-          background: #020617;
-          border-radius: 16px;
-          border: 1px solid #1f2937;
-          box-shadow: 0 20px 25px -5px rgba(0,0,0,0.5);
-        }}
-        h1 {{ margin-top: 0; text-align: center; font-size: 1.5rem; }}
-        label {{ display: block; font-size: 0.85rem; margin-bottom: 4px; color: #9ca3af; }}
-        input[type="text"], input[type="password"] {{
-          width: 100%;
-          max-width: 100%;
-          padding: 10px 12px;
-          margin-bottom: 12px;
-          border-radius: 10px;
-          border: 1px solid #374151;
-          background: #020617;
-          color: #e5e7eb;
-          font-size: 0.95rem;
-          outline: none;
-        }}
-        button {{
-          width: 100%;
-          max-width: 100%;
-          padding: 10px;
-          border-radius: 999px;
-          border: none;
-          cursor: pointer;
-          background: linear-gradient(135deg, #22c55e, #16a34a);
-          color: white;
-          font-weight: 700;
-          font-size: 0.95rem;
-        }}
-        .error {{ color: #f97316; font-size: 0.9rem; margin-bottom: 10px; text-align: center; }}
-      </style>
-    </head>
-    <body>
-      <div class="container">
-        <h1>Betfair Bot Login</h1>
-        {("<div class='error'>" + error + "</div>") if error else ""}
-        <form method="POST" action="/login">
-          <label for="username">Username</label>
-          <input type="text" name="username" id="username" autocomplete="username" />
-          <label for="password">Password</label>
-          <input type="password" name="password" id="password" autocomplete="current-password" />
-          <button type="submit">Log In</button>
-        </form>
-      </div>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
-
-
-def _dutch_stakes(total_stake: float, o1: float, o2: float) -> Dict[str, float]:
-    inv_sum = (1.0 / o1) + (1.0 / o2)
-    if inv_sum <= 0:
-        return {"stake1": 0.0, "stake2": 0.0, "profit_each": -total_stake}
-    s1 = total_stake * (1.0 / o1) / inv_sum
-    s2 = total_stake - s1
-    profit_each = total_stake / inv_sum - total_stake
-    return {"stake1": s1, "stake2": s2, "profit_each": profit_each}
-
-
-def _safe_float(x: Any) -> Optional[float]:
-    try:
-        return float(x)
-    except Exception:
-        return None
+    return _json_response({"lines": lines})
 
 
-def _start_time_iso_z(client: BetfairClient, market_id: str) -> str:
-    try:
-        st = client.get_market_start_time(market_id)
-        if st is None:
-            return ""
-        if st.tzinfo is None:
-            st = st.replace(tzinfo=dt.timezone.utc)
-        else:
-            st = st.astimezone(dt.timezone.utc)
-        return st.isoformat().replace("+00:00", "Z")
-    except Exception as e:
-        print("[WEBAPP] Could not fetch start time for", market_id, ":", e)
-        return ""
-
-
-def render_dashboard(message: str = "") -> HTMLResponse:
-    client = get_client()
+@app.get("/api/state", dependencies=[Depends(require_api_auth)])
+async def api_state():
+    return _json_response(_state_payload())
 
-    bf_balance: Optional[float] = None
-    try:
-        funds = client.get_account_funds()
-        bf_balance = _safe_float(funds.get("available_to_bet"))
-    except Exception as e:
-        print("[WEBAPP] Error fetching account funds:", e)
 
+# Polled far less often than /api/state: every refill is a Betfair account call.
+@app.get("/api/funds", dependencies=[Depends(require_api_auth)])
+async def api_funds():
     try:
-        markets = client.get_todays_novice_hurdle_markets()
+        funds = await cached_funds(await aget_client())
     except Exception as e:
-        print("[WEBAPP] Error fetching markets:", e)
-        markets = []
-
-    selected = set(getattr(state, "selected_markets", []) or [])
-
-    running = bool(getattr(state, "running", False))
-    bank = float(getattr(state, "bank", 100.0) or 100.0)
-    starting_bank = float(getattr(state, "starting_bank", bank) or bank)
-    day_pl = bank - starting_bank
-
-    history: List[Dict[str, Any]] = []
-    if hasattr(state, "history") and state.history:
-        history = list(state.history)[-15:][::-1]
-
-    stake_percent = float(getattr(state, "stake_percent", 5.0) or 5.0)
-    total_stake = bank * (stake_percent / 100.0)
-
-    html = f"""
-    <html>
-    <head>
-      <title>Betfair 2-Fav Dutching Bot</title>
-      <meta name="viewport" content="width=device-width, initial-scale=1" />
-      <style>
-        * {{ box-sizing: border-box; }}
-        html, body {{ width: 100%; max-width: 100%; overflow-x: hidden; }}
-        body {{
-          margin: 0;
-          font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-          background: #020617;
-          color: #e5e7eb;
-        }}
-        a {{ color: #38bdf8; text-decoration: none; }}
-        a:hover {{ text-decoration: underline; }}
-
-        .page {{ width: 100%; max-width: 1200px; margin: 0 auto; padding: 14px; }}
-
-        .top {{
-          display: flex;
-          flex-wrap: wrap;
-          justify-content: space-between;
-          align-items: flex-start;
-          gap: 10px;
-          margin-bottom: 12px;
-        }}
-        h1 {{ margin: 0; font-size: 1.4rem; }}
-        .sub {{ font-size: 0.82rem; color: #9ca3af; }}
-
-        .pill {{
-          border-radius: 999px;
-          padding: 4px 10px;
-          font-size: 0.75rem;
-          display: inline-flex;
-          align-items: center;
-          gap: 6px;
-          white-space: nowrap;
-        }}
-        .pill.green {{
-          background: rgba(34,197,94,0.1);
-          border: 1px solid rgba(34,197,94,0.3);
-          color: #4ade80;
-        }}
-        .pill.red {{
-          background: rgba(248,113,113,0.1);
-          border: 1px solid rgba(248,113,113,0.3);
-          color: #fca5a5;
-        }}
-
-        .grid {{
-          display: grid;
-          grid-template-columns: 1.1fr 1fr;
-          gap: 14px;
-        }}
-        @media (max-width: 900px) {{
-          .grid {{ grid-template-columns: 1fr; }}
-        }}
-
-        .card {{
-          background: #020617;
-          border-radius: 16px;
-          border: 1px solid #1f2937;
-          padding: 12px 14px;
-          box-shadow: 0 20px 25px -5px rgba(0,0,0,0.4);
-          min-width: 0;
-        }}
-
-        label {{ display: block; font-size: 0.8rem; margin-bottom: 3px; color: #9ca3af; }}
-
-        input[type="number"], input[type="text"] {{
-          width: 100%;
-          max-width: 100%;
-          padding: 8px 10px;
-          border-radius: 10px;
-          border: 1px solid #374151;
-          background: #020617;
-          color: #e5e7eb;
-          font-size: 0.9rem;
-          outline: none;
-        }}
-
-        .row {{
-          display: flex;
-          flex-wrap: wrap;
-          gap: 10px;
-        }}
-        .row > div {{
-          flex: 1 1 160px;
-          min-width: 0;
-        }}
-
-        .btn {{
-          border-radius: 999px;
-          padding: 8px 14px;
-          border: none;
-          cursor: pointer;
-          font-size: 0.85rem;
-          font-weight: 700;
-          display: inline-flex;
-          align-items: center;
-          justify-content: center;
-          gap: 8px;
-          max-width: 100%;
-        }}
-        .btn.primary {{
-          background: linear-gradient(135deg, #22c55e, #16a34a);
-          color: white;
-        }}
-        .btn.secondary {{
-          background: #0f172a;
-          color: #e5e7eb;
-          border: 1px solid #374151;
-        }}
-        .btn.danger {{
-          background: #b91c1c;
-          color: white;
-        }}
-        .btn.small {{
-          padding: 6px 10px;
-          font-size: 0.78rem;
-        }}
-
-        .message {{ color: #f97316; font-size: 0.85rem; margin-bottom: 10px; }}
-        .green-text {{ color: #4ade80; }}
-        .red-text {{ color: #fca5a5; }}
-
-        .list {{
-          max-height: 320px;
-          overflow-y: auto;
-          border-radius: 10px;
-          border: 1px solid #1f2937;
-          padding: 8px;
-        }}
-        .list label span, .list span, .list div, .list {{
-          overflow-wrap: anywhere;
-          word-break: break-word;
-        }}
-
-        .table-wrap {{
-          width: 100%;
-          overflow-x: auto;
-          -webkit-overflow-scrolling: touch;
-          border-radius: 10px;
-          border: 1px solid #1f2937;
-        }}
-        table {{
-          width: 100%;
-          border-collapse: collapse;
-          min-width: 640px;
-          font-size: 0.85rem;
-        }}
-        th, td {{
-          padding: 8px 10px;
-          border-bottom: 1px solid #1f2937;
-          vertical-align: top;
-        }}
-        th {{
-          text-align: left;
-          color: #9ca3af;
-          font-weight: 700;
-        }}
-        tr:last-child td {{ border-bottom: none; }}
-
-        .muted {{ color: #9ca3af; }}
-        .mono {{ font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace; }}
-      </style>
-    </head>
-    <body>
-      <div class="page">
-
-        <div class="top">
-          <div>
-            <h1>Betfair 2-Fav Dutching Bot</h1>
-            <div class="sub">
-              Logged in as <strong>{ADMIN_USERNAME}</strong> |
-              <a href="/logout">Log out</a> |
-              <a href="/inspect_hurdles">Inspect Markets</a>
-            </div>
-          </div>
-
-          <div style="text-align:right;">
-            <div class="pill {"green" if running else "red"}">
-              <span style="font-size:0.7rem;">●</span>
-              {"Running" if running else "Stopped"}
-            </div>
-            <div class="sub" style="margin-top:6px;">
-              Mode: {"DUMMY" if USE_DUMMY else "LIVE READ-ONLY (no placeOrders)"}
-            </div>
-          </div>
-        </div>
-
-        {f"<div class='message'><b>{message}</b></div>" if message else ""}
-
-        <div class="grid">
-
-          <!-- LEFT -->
-          <div class="card">
-            <h3 style="margin:0 0 10px 0;">Bank & Settings</h3>
-
-            <form method="post" action="/update_settings">
-              <div class="row">
-                <div>
-                  <label>Starting bank (£)</label>
-                  <input name="starting_bank" value="{getattr(state,'starting_bank',100.0)}">
-                </div>
-                <div>
-                  <label>Current bank (£)</label>
-                  <input name="current_bank" value="{getattr(state,'bank',100.0)}">
-                </div>
-              </div>
-
-              <div class="row" style="margin-top:10px;">
-                <div>
-                  <label>Stake %</label>
-                  <input name="stake_percent" value="{getattr(state,'stake_percent',5.0)}">
-                </div>
-                <div>
-                  <label>Seconds before off (default 60)</label>
-                  <input name="seconds_before_off" value="{getattr(state,'seconds_before_off',60)}">
-                </div>
-              </div>
-
-              <div style="margin-top:10px;">
-                <div class="sub" style="margin-bottom:6px;">Quick stake profiles (% of bank)</div>
-                <div style="display:flex; flex-wrap:wrap; gap:8px;">
-                  <button class="btn secondary small" name="profile" value="2" type="submit">2%</button>
-                  <button class="btn secondary small" name="profile" value="5" type="submit">5%</button>
-                  <button class="btn secondary small" name="profile" value="10" type="submit">10%</button>
-                  <button class="btn secondary small" name="profile" value="15" type="submit">15%</button>
-                  <button class="btn secondary small" name="profile" value="20" type="submit">20%</button>
-                </div>
-              </div>
-
-              <div style="margin-top:10px; display:flex; flex-wrap:wrap; gap:10px;">
-                <button class="btn primary" type="submit">Save</button>
-                <button class="btn secondary" name="reset_bank" value="1" type="submit">Reset</button>
-              </div>
-
-              <div style="margin-top:10px;">
-                <div class="sub">
-                  Recovery target: <span class="mono">£{getattr(state,'recovery_target',0.0):.2f}</span> |
-                  Stop after win: <span class="mono">{'YES' if getattr(state,'stop_after_win',True) else 'NO'}</span>
-                </div>
-              </div>
-            </form>
-
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">Races</h3>
-            <div class="sub" style="margin-bottom:8px;">
-              Tick races and save selection. Countdown uses Betfair market start time.
-            </div>
-
-            <form method="post" action="/update_race_selection">
-              <div class="list">
-    """
-
-    if not markets:
-        html += """
-                <div class="sub" style="color:#f97316;">
-                  No markets returned.
-                </div>
-        """
-    else:
-        for m in markets:
-            mid = m.get("market_id") or ""
-            name = m.get("name", mid)
-            checked = "checked" if mid in selected else ""
-            start_raw = _start_time_iso_z(client, mid) if mid else ""
-            html += f"""
-                <label style="display:flex; gap:10px; align-items:flex-start; margin:8px 0;">
-                  <input type="checkbox" name="selected_markets" value="{mid}" {checked} style="margin-top:3px;">
-                  <span style="font-size:0.92rem; line-height:1.25;">
-                    {name}
-                    <div class="sub mono" style="margin-top:4px;">
-                      <span class="countdown" data-start="{start_raw}">—</span>
-                      <span class="muted"> | {mid}</span>
-                    </div>
-                  </span>
-                </label>
-            """
-
-    html += f"""
-              </div>
-
-              <div style="margin-top:10px;">
-                <button class="btn secondary" type="submit">Save races</button>
-              </div>
-            </form>
-          </div>
-
-          <!-- RIGHT -->
-          <div class="card">
-            <h3 style="margin:0 0 10px 0;">Status & Controls</h3>
-
-            <div class="row" style="margin-bottom:10px;">
-              <div>
-                <div class="sub">Current bank</div>
-                <div style="font-size:1.2rem;">£{bank:.2f}</div>
-              </div>
-              <div>
-                <div class="sub">Day P/L</div>
-                <div class="{"green-text" if day_pl >= 0 else "red-text"}" style="font-size:1.1rem;">
-                  £{day_pl:.2f}
-                </div>
-              </div>
-              <div>
-                <div class="sub">Betfair balance</div>
-                <div style="font-size:1.05rem;">
-                  {("£" + f"{bf_balance:.2f}") if bf_balance is not None else "—"}
-                </div>
-              </div>
-            </div>
-
-            <div style="display:flex; flex-wrap:wrap; gap:10px;">
-              <form method="post" action="/start">
-                <button class="btn primary" type="submit">▶ Start</button>
-              </form>
-              <form method="post" action="/stop">
-                <button class="btn danger" type="submit">■ Stop</button>
-              </form>
-            </div>
-
-            <div style="margin-top:12px;">
-              <div class="sub">
-                Auto-results: <b>ON</b> (the bot will settle each race automatically after the off).
-              </div>
-            </div>
-
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">Live odds + projected winnings</h3>
-            <div class="sub" style="margin-bottom:8px;">
-              Auto-refreshes every ~7 seconds from <span class="mono">/api/selected_live_odds</span>.
-            </div>
-
-            <div class="table-wrap">
-              <table>
-                <thead>
-                  <tr>
-                    <th>Race</th>
-                    <th>Countdown</th>
-                    <th>Fav 1</th>
-                    <th>Odds</th>
-                    <th>Stake</th>
-                    <th>Fav 2</th>
-                    <th>Odds</th>
-                    <th>Stake</th>
-                    <th>Profit if wins</th>
-                  </tr>
-                </thead>
-                <tbody id="oddsBody">
-                  <tr>
-                    <td colspan="9" class="muted">Select one or more races to see live odds + winnings here.</td>
-                  </tr>
-                </tbody>
-              </table>
-            </div>
-
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">History</h3>
-    """
-
-    if history:
-        html += """
-            <div class="table-wrap">
-              <table>
-                <thead>
-                  <tr>
-                    <th>#</th>
-                    <th>Race</th>
-                    <th>Favourites</th>
-                    <th>Total stake</th>
-                    <th>P/L</th>
-                  </tr>
-                </thead>
-                <tbody>
-        """
-        for i, h in enumerate(history, 1):
-            race_name = h.get("race_name", "?")
-            favs = h.get("favs", "")
-            total_stake_h = float(h.get("total_stake", 0.0) or 0.0)
-            pl = float(h.get("pl", 0.0) or 0.0)
-            cls = "green-text" if pl >= 0 else "red-text"
-            html += f"""
-                  <tr>
-                    <td>{i}</td>
-                    <td style="min-width:220px;">{race_name}</td>
-                    <td>{favs}</td>
-                    <td>£{total_stake_h:.2f}</td>
-                    <td class="{cls}">£{pl:.2f}</td>
-                  </tr>
-            """
-        html += """
-                </tbody>
-              </table>
-            </div>
-        """
-    else:
-        html += """
-            <div class="sub muted">No races yet.</div>
-        """
-
-    # Logs panel
-    html += """
-            <hr style="border-color:#1f2937; margin:14px 0;">
-
-            <h3 style="margin:0 0 8px 0;">Logs</h3>
-            <div class="sub" style="margin-bottom:8px;">Live app logs (auto-refresh)</div>
-
-            <div style="border:1px solid #1f2937;border-radius:10px; padding:10px; max-height:260px; overflow:auto;">
-              <pre id="logBox" style="margin:0; white-space:pre-wrap; overflow-wrap:anywhere; font-size:0.78rem; line-height:1.2;"></pre>
-            </div>
-
-            <div style="display:flex;gap:10px;margin-top:10px;flex-wrap:wrap;">
-              <button class="btn secondary small" type="button" onclick="fetchLogs(true)">Refresh</button>
-              <button class="btn secondary small" type="button" onclick="clearLogBox()">Clear</button>
-            </div>
-    """
-
-    html += """
-          </div>
-        </div>
-      </div>
-
-      <script>
-        function parseISO(s) {
-          if (!s) return null;
-          const d = new Date(s);
-          if (isNaN(d.getTime())) return null;
-          return d;
-        }
-
-        function fmt(sec) {
-          sec = Math.max(0, Math.floor(sec));
-          const h = Math.floor(sec / 3600);
-          const m = Math.floor((sec % 3600) / 60);
-          const s = sec % 60;
-          if (h > 0) return String(h) + "h " + String(m) + "m " + String(s) + "s";
-          if (m > 0) return String(m) + "m " + String(s) + "s";
-          return String(s) + "s";
-        }
-
-        function tickCountdowns() {
-          const els = document.querySelectorAll(".countdown");
-          const now = new Date();
-          els.forEach(el => {
-            const startRaw = el.getAttribute("data-start") || "";
-            const start = parseISO(startRaw);
-            if (!start) { el.textContent = "—"; return; }
-            const diffSec = (start.getTime() - now.getTime()) / 1000;
-            if (diffSec <= 0) { el.textContent = "OFF / started"; return; }
-            el.textContent = "Off in " + fmt(diffSec);
-          });
-        }
-
-        // ---- Odds auto-refresh ----
-        function escapeHtml(s) {
-          return String(s)
-            .replaceAll("&", "&amp;")
-            .replaceAll("<", "&lt;")
-            .replaceAll(">", "&gt;")
-            .replaceAll('"', "&quot;")
-            .replaceAll("'", "&#039;");
-        }
-
-        async function refreshOdds() {
-          try {
-            const r = await fetch("/api/selected_live_odds", { cache: "no-store" });
-            if (!r.ok) return;
-            const j = await r.json();
-            const rows = (j.rows || []);
-            const body = document.getElementById("oddsBody");
-            if (!body) return;
-
-            if (!rows.length) {
-              body.innerHTML = "<tr><td colspan='9' class='muted'>Select one or more races to see live odds + winnings here.</td></tr>";
-              return;
-            }
-
-            let html = "";
-            for (const row of rows) {
-              if (row.error) {
-                html += "<tr><td colspan='9' class='muted'>Error for " + escapeHtml(row.market_id) + ": " + escapeHtml(row.error) + "</td></tr>";
-                continue;
-              }
-
-              const race = row.race || row.market_id;
-              const start_raw = row.start_raw || "";
-              const fav1 = (row.fav1 && row.fav1.name) ? row.fav1.name : (row.fav1_name || "—");
-              const fav2 = (row.fav2 && row.fav2.name) ? row.fav2.name : (row.fav2_name || "—");
-
-              const odds1 = row.odds1;
-              const odds2 = row.odds2;
-              const s1 = row.stake1;
-              const s2 = row.stake2;
-              const profit = row.profit_if_win;
-
-              const profitClass = (typeof profit === "number" && profit >= 0) ? "green-text" : "red-text";
-
-              html += "<tr>"
-                + "<td style='min-width:220px;'>" + escapeHtml(race) + "</td>"
-                + "<td class='mono'><span class='countdown' data-start='" + escapeHtml(start_raw) + "'>—</span></td>"
-                + "<td>" + escapeHtml(fav1) + "</td>"
-                + "<td>" + (typeof odds1 === "number" ? odds1.toFixed(2) : "—") + "</td>"
-                + "<td>£" + (typeof s1 === "number" ? s1.toFixed(2) : "—") + "</td>"
-                + "<td>" + escapeHtml(fav2) + "</td>"
-                + "<td>" + (typeof odds2 === "number" ? odds2.toFixed(2) : "—") + "</td>"
-                + "<td>£" + (typeof s2 === "number" ? s2.toFixed(2) : "—") + "</td>"
-                + "<td class='" + profitClass + "'>£" + (typeof profit === "number" ? profit.toFixed(2) : "—") + "</td>"
-                + "</tr>";
-            }
-
-            body.innerHTML = html;
-            tickCountdowns(); // update countdowns for newly inserted rows
-          } catch (e) {}
-        }
-
-        // ---- UI logs ----
-        async function fetchLogs(forceScroll=false) {
-          try {
-            const r = await fetch("/api/logs?n=250", { cache: "no-store" });
-            if (!r.ok) return;
-            const j = await r.json();
-            const el = document.getElementById("logBox");
-            if (!el) return;
-
-            const nearBottom = (el.scrollTop + el.clientHeight) >= (el.scrollHeight - 40);
-            el.textContent = (j.lines || []).join("\\n");
-            if (forceScroll || nearBottom) el.scrollTop = el.scrollHeight;
-          } catch (e) {}
-        }
-
-        function clearLogBox() {
-          const el = document.getElementById("logBox");
-          if (el) el.textContent = "";
-        }
-
-        tickCountdowns();
-        setInterval(tickCountdowns, 1000);
-
-        refreshOdds();
-        setInterval(refreshOdds, 7000);
-
-        fetchLogs(true);
-        setInterval(fetchLogs, 2000);
-      </script>
-    </body>
-    </html>
-    """
-
-    return HTMLResponse(html)
-
-
-@app.get("/login")
-async def login_get(request: Request):
-    if is_logged_in(request):
-        return RedirectResponse("/", status_code=303)
-    return render_login_page()
-
-
-@app.post("/login")
-async def login_post(request: Request, username: str = Form(...), password: str = Form(...)):
-    if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-        request.session["user"] = "admin"
-        return RedirectResponse("/", status_code=303)
-    return render_login_page("Invalid username or password.")
-
-
-@app.get("/logout")
-async def logout(request: Request):
-    request.session.clear()
-    return RedirectResponse("/login", status_code=303)
-
-
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-    return render_dashboard()
-
-
-@app.post("/update_settings")
-async def update_settings(
-    request: Request,
-    starting_bank: str = Form(...),
-    current_bank: str = Form(...),
-    stake_percent: str = Form(...),
-    seconds_before_off: str = Form("60"),
-    profile: str = Form(None),
-    reset_bank: str = Form(None),
-):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
-    try:
-        sb = float(starting_bank)
-    except Exception:
-        sb = float(getattr(state, "starting_bank", 100.0) or 100.0)
-
-    try:
-        cb = float(current_bank)
-    except Exception:
-        cb = float(getattr(state, "bank", sb) or sb)
-
-    try:
-        sp = float(stake_percent)
-    except Exception:
-        sp = float(getattr(state, "stake_percent", 5.0) or 5.0)
-
-    if profile in ("2", "5", "10", "15", "20"):
-        sp = float(profile)
-
-    try:
-        sbo = int(float(seconds_before_off))
-    except Exception:
-        sbo = int(getattr(state, "seconds_before_off", 60) or 60)
-
-    state.starting_bank = sb
-    state.bank = sb if reset_bank else cb
-    state.stake_percent = sp
-    state.seconds_before_off = sbo
-
-    return render_dashboard("Settings saved.")
-
-
-@app.post("/update_race_selection")
-async def update_race_selection(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
-    form = await request.form()
-    state.selected_markets = form.getlist("selected_markets")
-    state.current_index = 0
-    return render_dashboard("Races updated.")
-
-
-@app.post("/start")
-async def start_bot(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
-    if not getattr(state, "selected_markets", []):
-        return render_dashboard("No races selected – tick at least one race and save.")
+        funds = e
+    bf_balance, bf_err = _funds_view(funds)
+    return _json_response({"bf_balance": bf_balance, "bf_err": bf_err})
 
-    get_client()
-    assert runner is not None
-    runner.start()
-    return render_dashboard("Bot started.")
 
+# Dispatcher for _ACTIONS. Must stay registered after every other POST route.
+@app.post("/{action}", dependencies=[Depends(require_auth)])
+async def action_post(request: Request, action: str):
+    fn = _ACTIONS.get(action)
+    if fn is None:
+        raise HTTPException(status_code=404)
+    return _action_response(request, await fn())
 
-@app.post("/stop")
-async def stop_bot(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
 
-    get_client()
-    assert runner is not None
-    runner.stop()
-    return render_dashboard("Bot stopped.")
-
-
-@app.get("/inspect_hurdles")
-async def inspect_hurdles(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return redirect
-
-    client = get_client()
-    markets = client.get_todays_novice_hurdle_markets()
-
-    items = "".join(
-        f"<li>{m.get('name','?')} "
-        f"<span style='color:#9ca3af;'>({m.get('market_id','?')})</span></li>"
-        for m in markets
+# -------------------------
+# GET on POST-only actions
+# -------------------------
+# Reloading / bookmarking the URL a form posted to (e.g. /start) would
+# otherwise 405. One catch-all route bounces those back to the dashboard.
+# Must stay registered after every other GET route.
+
+_REDIRECT_ACTIONS = frozenset({"update_settings", "update_race_selection", *_ACTIONS})
+_REDIRECT_RESPONSE = RedirectResponse("/", status_code=303)
+
+
+@app.get("/{action}")
+async def action_get(action: str):
+    if action in _REDIRECT_ACTIONS:
+        return _REDIRECT_RESPONSE
+    raise HTTPException(status_code=404)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools come with uvicorn[standard]. Keep a single worker:
+    # the bot runner, its state and the render caches all live in-process.
+    # No access log: the pollers alone would write several lines a second.
+    # Passing the app object (not "webapp:app") avoids importing this module
+    # a second time under its own name.
+    uvicorn.run(
+        app,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+        reload=False,
+        access_log=False,
     )
-
-    html = f"""
-    <html>
-      <head>
-        <meta name="viewport" content="width=device-width, initial-scale=1" />
-        <title>Inspect Markets</title>
-      </head>
-      <body style="font-family:system-ui;background:#020617;color:#e5e7eb;padding:14px;max-width:100%;overflow-x:hidden;">
-        <h2>Inspect Markets</h2>
-        <p><a href="/" style="color:#38bdf8;">Back</a></p>
-        <p>Dummy mode: <b>{"ON" if USE_DUMMY else "OFF"}</b></p>
-        <ul>{items}</ul>
-      </body>
-    </html>
-    """
-    return HTMLResponse(html)
-
-
-@app.get("/api/selected_live_odds")
-async def api_selected_live_odds(request: Request):
-    redirect = require_login(request)
-    if redirect:
-        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
-
-    client = get_client()
-
-    bank = float(getattr(state, "bank", 100.0) or 100.0)
-    stake_percent = float(getattr(state, "stake_percent", 5.0) or 5.0)
-    total_stake = bank * (stake_percent / 100.0)
-
-    rows = []
-    for mid in getattr(state, "selected_markets", []) or []:
-        try:
-            favs = client.get_top_two_favourites(mid)
-            if len(favs) < 2:
-                continue
-
-            o1 = float(favs[0]["back"])
-            o2 = float(favs[1]["back"])
-            calc = _dutch_stakes(total_stake, o1, o2)
-
-            rows.append(
-                {
-                    "market_id": mid,
-                    "race": client.get_market_name(mid),
-                    "start_raw": _start_time_iso_z(client, mid),
-                    "fav1": {"name": favs[0].get("name", "—"), "selection_id": favs[0].get("selection_id")},
-                    "fav2": {"name": favs[1].get("name", "—"), "selection_id": favs[1].get("selection_id")},
-                    "odds1": o1,
-                    "odds2": o2,
-                    "total_stake": total_stake,
-                    "stake1": calc["stake1"],
-                    "stake2": calc["stake2"],
-                    "profit_if_win": calc["profit_each"],
-                }
-            )
-        except Exception as e:
-            rows.append({"market_id": mid, "error": str(e)})
-
-    return JSONResponse({"rows": rows})
-
-
-@app.get("/api/logs")
-async def api_logs(request: Request, n: int = 250):
-    redirect = require_login(request)
-    if redirect:
-        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
-
-    try:
-        n = int(n)
-    except Exception:
-        n = 250
-    n = max(1, min(n, 800))
-
-    lines = list(LOG_BUFFER)[-n:]
-    return JSONResponse({"lines": lines})
-